@@ -7,9 +7,14 @@
 
 import os
 import sys
-import importlib.util
+import atexit
+import queue
 import argparse
 import logging
+import subprocess
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pymysql
 from typing import List, Dict, Any
@@ -23,15 +28,23 @@ logs_dir = os.path.join(project_root, 'logs')
 os.makedirs(logs_dir, exist_ok=True)
 
 # 配置日志 - 输出到文件和控制台
+# 日志调用只入队，由后台监听线程负责写文件和控制台
 from datetime import datetime
 log_filename = os.path.join(logs_dir, f'factors_main_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+file_handler.setFormatter(log_formatter)
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(log_formatter)
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, file_handler, console_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+# 队列处理器只传递消息文本，完整格式由监听线程中的处理器输出
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    format='%(message)s',
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
@@ -59,6 +72,7 @@ class FactorCalculationScheduler:
             'root': [],
         }
         self.trade_date = self._get_current_trade_date()
+        self.script_timeout = None  # 单个脚本最长执行秒数，None表示不限制
 
     def _get_current_trade_date(self) -> str:
         try:
@@ -124,7 +138,7 @@ class FactorCalculationScheduler:
     
     def load_and_execute_script(self, script_path: Path) -> bool:
         """
-        动态加载并执行脚本的main函数
+        在独立子进程中执行脚本，并传入交易日参数
         
         Args:
             script_path (Path): 脚本文件路径
@@ -132,62 +146,62 @@ class FactorCalculationScheduler:
         Returns:
             bool: 执行是否成功
         """
+        process = None
+        timer = None
         try:
-            logger.info(f"开始执行脚本: {script_path}")
+            logger.info(f"开始执行脚本: {script_path} (date={self.trade_date})")
             
-            # 动态加载模块
-            spec = importlib.util.spec_from_file_location(
-                script_path.stem, script_path
+            # 子进程不缓冲并固定UTF-8输出，保证日志实时转发且不受cron环境的locale影响
+            env = dict(os.environ, PYTHONUNBUFFERED='1', PYTHONIOENCODING='utf-8')
+            process = subprocess.Popen(
+                [sys.executable, str(script_path), '--date', self.trade_date],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding='utf-8',
+                errors='replace',
+                env=env,
             )
-            module = importlib.util.module_from_spec(spec)
             
-            # 执行模块
-            spec.loader.exec_module(module)
+            # 超时后终止子进程，读取循环随输出关闭而结束
+            if self.script_timeout:
+                timer = threading.Timer(self.script_timeout, process.kill)
+                timer.start()
             
-            # 调用main函数，优先注入交易日参数
-            if hasattr(module, 'main'):
-                import sys as _sys
-                orig_argv = list(_sys.argv)
-                try:
-                    _sys.argv = [script_path.name, '--date', self.trade_date]
-                    module.main()
-                    logger.info(f"脚本执行成功: {script_path} (date={self.trade_date})")
-                    return True
-                except SystemExit as ex:
-                    if ex.code == 0:
-                        logger.info(f"脚本执行成功: {script_path} (date={self.trade_date})")
-                        return True
-                    logger.warning(f"脚本不支持 --date 参数或参数错误，改用默认参数执行: {script_path}")
-                    try:
-                        _sys.argv = [script_path.name]
-                        module.main()
-                        logger.info(f"脚本执行成功: {script_path}")
-                        return True
-                    except SystemExit as ex2:
-                        if ex2.code == 0:
-                            logger.info(f"脚本执行成功: {script_path}")
-                            return True
-                        logger.error(f"脚本执行失败(默认参数): {script_path}")
-                        return False
-                    except Exception as e2:
-                        logger.error(f"脚本执行异常(默认参数): {script_path}: {e2}")
-                        return False
-                finally:
-                    _sys.argv = orig_argv
-            else:
-                logger.error(f"脚本缺少main函数: {script_path}")
+            # 子进程输出逐行写入调度器日志
+            for line in process.stdout:
+                logger.info(f"[{script_path.name}] {line.rstrip()}")
+            returncode = process.wait()
+            
+            if timer and not timer.is_alive() and returncode != 0:
+                logger.error(f"脚本执行超时: {script_path}，超过 {self.script_timeout} 秒")
                 return False
+            if returncode == 0:
+                logger.info(f"脚本执行成功: {script_path} (date={self.trade_date})")
+                return True
+            logger.error(f"脚本执行失败: {script_path}，退出码: {returncode}")
+            return False
                 
         except Exception as e:
             logger.error(f"脚本执行失败 {script_path}: {e}")
+            if process and process.poll() is None:
+                process.kill()
             return False
+        finally:
+            if timer:
+                timer.cancel()
+            if process and process.stdout:
+                process.stdout.close()
     
-    def execute_stock_scripts(self, continue_on_error: bool = True) -> bool:
+    def execute_stock_scripts(self, continue_on_error: bool = True, max_workers: int = None) -> bool:
         """
         执行stock目录下的所有脚本
         
+        各脚本读写不同的因子表，相互独立，默认在独立子进程中并行执行；
+        遇到错误即停止时按顺序串行执行。
+        
         Args:
             continue_on_error (bool): 遇到错误时是否继续执行
+            max_workers (int): 并行执行的脚本数，默认全部并行，1表示串行
             
         Returns:
             bool: 所有脚本是否都执行成功
@@ -197,6 +211,18 @@ class FactorCalculationScheduler:
         scripts = self.get_available_scripts()['stock']
         success_count = 0
         
+        workers = min(max_workers or len(scripts), len(scripts))
+        if continue_on_error and workers > 1:
+            logger.info(f"并行执行 {len(scripts)} 个脚本，并发数: {workers}")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    lambda script: self.load_and_execute_script(self.stock_dir / script),
+                    scripts,
+                ))
+            success_count = sum(results)
+            logger.info(f"stock脚本执行完成: {success_count}/{len(scripts)} 成功")
+            return success_count == len(scripts)
+        
         for script in scripts:
             script_path = self.stock_dir / script
             success = self.load_and_execute_script(script_path)
@@ -233,12 +259,13 @@ class FactorCalculationScheduler:
         logger.error(f"脚本不存在: {script_name}")
         return False
     
-    def execute_all_scripts(self, continue_on_error: bool = True) -> bool:
+    def execute_all_scripts(self, continue_on_error: bool = True, max_workers: int = None) -> bool:
         """
         执行所有脚本
         
         Args:
             continue_on_error (bool): 遇到错误时是否继续执行
+            max_workers (int): stock脚本并行执行数，默认全部并行，1表示串行
             
         Returns:
             bool: 所有脚本是否都执行成功
@@ -246,7 +273,7 @@ class FactorCalculationScheduler:
         logger.info("开始执行所有因子计算脚本")
         
         # 先执行stock目录下的脚本
-        stock_success = self.execute_stock_scripts(continue_on_error)
+        stock_success = self.execute_stock_scripts(continue_on_error, max_workers)
         
         overall_success = stock_success
         
@@ -275,7 +302,7 @@ class FactorCalculationScheduler:
             print(f"  - {script}")
         
         print("\n执行顺序:")
-        print("1. Stock目录脚本 (按顺序执行)")
+        print("1. Stock目录脚本 (默认并行执行，--jobs 1 或 --stop-on-error 时按顺序执行)")
         print("2. 根目录脚本 (按顺序执行)")
         print("=" * 50)
 
@@ -295,6 +322,7 @@ def main():
   python main.py -s hot.py                # 执行单个脚本
   python main.py --list                   # 列出所有可用脚本
   python main.py --stop-on-error          # 遇到错误时停止执行
+  python main.py -j 1                     # 串行执行stock目录下的脚本
         """
     )
     
@@ -314,6 +342,18 @@ def main():
         help='指定交易日期 (YYYY-MM-DD)'
     )
     
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='stock脚本并行执行数 (默认: 全部并行, 1 表示串行)'
+    )
+    
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        help='单个脚本最长执行秒数，超时后终止 (默认: 不限制)'
+    )
+    
     parser.add_argument(
         '--list',
         action='store_true',
@@ -340,6 +380,8 @@ def main():
     scheduler = FactorCalculationScheduler()
     if args.date:
         scheduler.trade_date = args.date
+    if args.timeout:
+        scheduler.script_timeout = args.timeout
     
     # 列出可用脚本
     if args.list:
@@ -362,9 +404,9 @@ def main():
         
         # 根据目录参数执行脚本
         if args.directory == 'stock':
-            success = scheduler.execute_stock_scripts(continue_on_error)
+            success = scheduler.execute_stock_scripts(continue_on_error, args.jobs)
         else:  # all
-            success = scheduler.execute_all_scripts(continue_on_error)
+            success = scheduler.execute_all_scripts(continue_on_error, args.jobs)
         
         if success:
             print("所有指定脚本执行成功")
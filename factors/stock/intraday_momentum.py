@@ -7,6 +7,7 @@ import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
+import numpy as np
 import pandas as pd
 import pymysql
 
@@ -17,7 +18,10 @@ from config import config
 class IntradayMomentumCalculator:
     def __init__(self):
         self.db_config = config.database
+        self.connection = None
         self.logger = self._setup_logger()
+        self.insert_batch_size = 1000  # 每条多行INSERT的最大行数
+        self.range_chunk_days = 5  # 区间回补时每次查询的交易日数
 
     def _setup_logger(self) -> logging.Logger:
         logger = logging.getLogger(__name__)
@@ -30,8 +34,12 @@ class IntradayMomentumCalculator:
         return logger
 
     def _get_db_connection(self) -> pymysql.Connection:
+        """获取复用的数据库连接，断线时自动重连"""
         try:
-            conn = pymysql.connect(
+            if self.connection is not None:
+                self.connection.ping(reconnect=True)
+                return self.connection
+            self.connection = pymysql.connect(
                 host=self.db_config.host,
                 port=self.db_config.port,
                 user=self.db_config.user,
@@ -40,19 +48,29 @@ class IntradayMomentumCalculator:
                 charset=self.db_config.charset,
                 autocommit=False,
             )
-            return conn
+            return self.connection
         except Exception as e:
             self.logger.error(f"数据库连接失败: {e}")
             raise
 
+    def close(self):
+        """关闭数据库连接"""
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
     def get_trade_dates_in_range(self, start_date: str, end_date: str) -> List[str]:
         connection = None
         try:
             connection = self._get_db_connection()
             with connection.cursor() as cursor:
+                # 从交易日历取开市日，避免在5分钟大表上做DISTINCT扫描
                 sql = (
-                    "SELECT DISTINCT trade_date FROM trade_market_stock_5min "
-                    "WHERE trade_date BETWEEN %s AND %s ORDER BY trade_date"
+                    "SELECT cal_date FROM trade_market_calendar "
+                    "WHERE is_open = 1 AND cal_date BETWEEN %s AND %s ORDER BY cal_date"
                 )
                 cursor.execute(sql, (start_date, end_date))
                 rows = cursor.fetchall()
@@ -61,78 +79,80 @@ class IntradayMomentumCalculator:
         except Exception as e:
             self.logger.error(f"获取分时交易日期失败: {e}")
             return []
-        finally:
-            if connection:
-                connection.close()
 
     def fetch_5min_data_for_date(self, trade_date: str) -> pd.DataFrame:
         connection = None
         try:
             connection = self._get_db_connection()
-            with connection.cursor() as cursor:
-                sql = (
-                    "SELECT trade_date, code, name, trade_time, open, close, high, low, vol, amount "
-                    "FROM trade_market_stock_5min WHERE trade_date=%s"
-                )
-                cursor.execute(sql, (trade_date,))
-                rows = cursor.fetchall()
-                if not rows:
-                    return pd.DataFrame()
-                df = pd.DataFrame(rows, columns=['trade_date','code','name','trade_time','open','close','high','low','vol','amount'])
-                return df
+            sql = (
+                "SELECT trade_date, code, name, trade_time, open, close, high, low, vol, amount "
+                "FROM trade_market_stock_5min WHERE trade_date=%s"
+            )
+            # 直接读入列式DataFrame，避免先物化整批元组再构造
+            df = pd.read_sql(sql, connection, params=(trade_date,))
+            return df
         except Exception as e:
             self.logger.error(f"获取{trade_date}分时数据失败: {e}")
             return pd.DataFrame()
-        finally:
-            if connection:
-                connection.close()
 
-    @staticmethod
-    def _classify_main_action(row: pd.Series, prev_close: float, vol_avg: float) -> (str, str):
+    def fetch_5min_data_range(self, start_date: str, end_date: str) -> pd.DataFrame:
+        """一次性获取区间内的5分钟数据，供区间回补分段按日期分组使用"""
+        connection = None
         try:
-            close = float(row['close']) if row['close'] is not None else None
-            vol = float(row['vol']) if row['vol'] is not None else 0.0
-            if close is None or prev_close is None or prev_close <= 0:
-                return '', ''
-            ret = (close - prev_close) / prev_close
-            vol_ratio = (vol / vol_avg) if vol_avg > 0 else 0.0
-
-            if ret >= 0.01 and vol_ratio >= 1.5:
-                return '主力拉升', f"5min涨幅:{ret:.2%}, 量能倍数:{vol_ratio:.2f}"
-            if ret <= -0.007 and vol_ratio >= 1:
-                return '主力出货', f"5min跌幅:{ret:.2%}, 量能倍数:{vol_ratio:.2f}"
-            return '无明显动作', f"涨幅:{ret:.2%}, 量能倍数:{vol_ratio:.2f}"
-        except Exception:
-            return '', ''
+            connection = self._get_db_connection()
+            sql = (
+                "SELECT trade_date, code, name, trade_time, open, close, high, low, vol, amount "
+                "FROM trade_market_stock_5min WHERE trade_date BETWEEN %s AND %s"
+            )
+            # 直接读入列式DataFrame，避免先物化整批元组再构造
+            df = pd.read_sql(sql, connection, params=(start_date, end_date))
+            return df
+        except Exception as e:
+            self.logger.error(f"获取{start_date}至{end_date}分时数据失败: {e}")
+            return pd.DataFrame()
 
     def build_intraday_actions(self, df: pd.DataFrame) -> pd.DataFrame:
         if df.empty:
             return df
         try:
-            # 类型转换
+            # 只保留计算所需的列，high/low/amount不参与判定，无需转换和排序
+            df = df[['trade_date', 'trade_time', 'code', 'name', 'open', 'close', 'vol']].copy()
+            # 类型转换：价格保持float64，涨幅阈值(1%)恰在最小变动价位上，float32会改变边界判定
             df['open'] = pd.to_numeric(df['open'], errors='coerce')
             df['close'] = pd.to_numeric(df['close'], errors='coerce')
-            df['high'] = pd.to_numeric(df['high'], errors='coerce')
-            df['low'] = pd.to_numeric(df['low'], errors='coerce')
             df['vol'] = pd.to_numeric(df['vol'], errors='coerce').fillna(0)
-            # 分组
-            out_rows = []
-            for code, g in df.groupby('code'):
-                g2 = g.sort_values('trade_time')
-                vol_avg = max(g2['vol'].mean(), 1.0)
-                prev_close = None
-                for _, r in g2.iterrows():
-                    action, semantic = self._classify_main_action(r, prev_close if prev_close is not None else r['open'], vol_avg)
-                    out_rows.append({
-                        'trade_date': r['trade_date'],
-                        'trade_time': r['trade_time'],
-                        'code': r['code'],
-                        'name': r['name'],
-                        'main_action': action,
-                        'main_action_semantic': semantic,
-                    })
-                    prev_close = r['close'] if not pd.isna(r['close']) else prev_close
-            return pd.DataFrame(out_rows)
+            # 代码转为category，排序和分组基于整数编码而非Python字符串哈希
+            df['code'] = df['code'].astype('category')
+            # 按代码、时间排序后整表向量化计算，避免逐行构造Series
+            df = df.sort_values(['code', 'trade_time'], kind='mergesort').reset_index(drop=True)
+            grouped = df.groupby('code', sort=False, observed=True)
+            # 上一根有效收盘价，首根K线用当根开盘价代替
+            prev_close = grouped['close'].shift(1).groupby(df['code'], sort=False, observed=True).ffill().fillna(df['open'])
+            vol_avg = grouped['vol'].transform('mean').clip(lower=1.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = ((df['close'] - prev_close) / prev_close).to_numpy()
+            vol_ratio = (df['vol'] / vol_avg).to_numpy()
+
+            actions = np.select(
+                [
+                    (prev_close <= 0).to_numpy(),
+                    (ret >= 0.01) & (vol_ratio >= 1.5),
+                    (ret <= -0.007) & (vol_ratio >= 1),
+                ],
+                ['', '主力拉升', '主力出货'],
+                default='无明显动作',
+            )
+            semantic_prefix = {'主力拉升': '5min涨幅', '主力出货': '5min跌幅', '无明显动作': '涨幅'}
+            semantics = [
+                f"{semantic_prefix[a]}:{r:.2%}, 量能倍数:{v:.2f}" if a else ''
+                for a, r, v in zip(actions.tolist(), ret.tolist(), vol_ratio.tolist())
+            ]
+
+            out = df[['trade_date', 'trade_time', 'code', 'name']].copy()
+            out['code'] = out['code'].astype(str)
+            out['main_action'] = actions
+            out['main_action_semantic'] = semantics
+            return out
         except Exception as e:
             self.logger.error(f"构建分时主力动作失败: {e}")
             return pd.DataFrame()
@@ -160,9 +180,45 @@ class IntradayMomentumCalculator:
             if connection:
                 connection.rollback()
             return False
-        finally:
-            if connection:
-                connection.close()
+
+    @staticmethod
+    def _norm_time(t):
+        try:
+            if hasattr(t, 'time'):
+                return t.time()
+            if isinstance(t, pd.Timedelta):
+                return (datetime.min + t.to_pytimedelta()).time()
+            if isinstance(t, timedelta):
+                return (datetime.min + t).time()
+            if isinstance(t, str):
+                try:
+                    return datetime.strptime(t, '%H:%M:%S').time()
+                except Exception:
+                    return datetime.strptime(t, '%H:%M').time()
+            return t
+        except Exception:
+            return t
+
+    @classmethod
+    def _norm_time_series(cls, times: pd.Series) -> pd.Series:
+        """整列转换为datetime.time，按列dtype分派，一次to_timedelta解析代替逐行分支判断"""
+        # TIME列经pymysql读出为timedelta64，直接换算，无需字符串往返
+        if pd.api.types.is_timedelta64_dtype(times):
+            return (pd.Timestamp('1970-01-01') + times).dt.time.astype(object)
+        if pd.api.types.is_datetime64_any_dtype(times):
+            return times.dt.time.astype(object)
+        if pd.api.types.infer_dtype(times, skipna=True) == 'time':
+            return times
+        text = times.astype(str)
+        # 'HH:MM' 补齐秒，保证 to_timedelta 可解析
+        text = text.where(text.str.count(':') != 1, text + ':00')
+        td = pd.to_timedelta(text, errors='coerce')
+        result = (pd.Timestamp('1970-01-01') + td).dt.time.astype(object)
+        # 少数无法按时长解析的值（如完整时间戳）回退逐个转换
+        leftover = td.isna()
+        if leftover.any():
+            result[leftover] = times[leftover].map(cls._norm_time)
+        return result
 
     def insert_intraday_actions(self, df: pd.DataFrame) -> bool:
         if df.empty:
@@ -172,35 +228,25 @@ class IntradayMomentumCalculator:
         try:
             connection = self._get_db_connection()
             with connection.cursor() as cursor:
-                sql = (
+                insert_sql = (
                     "INSERT INTO trade_factor_stock_intraday_momentum "
                     "(trade_date, trade_time, code, name, main_action, main_action_semantic, created_time, updated_time) "
-                    "VALUES (%s,%s,%s,%s,%s,%s,%s,%s) "
-                    "ON DUPLICATE KEY UPDATE main_action=VALUES(main_action), main_action_semantic=VALUES(main_action_semantic), updated_time=CURRENT_TIMESTAMP"
+                    "VALUES "
                 )
+                update_sql = (
+                    " ON DUPLICATE KEY UPDATE main_action=VALUES(main_action), main_action_semantic=VALUES(main_action_semantic), updated_time=CURRENT_TIMESTAMP"
+                )
+                row_template = "(%s,%s,%s,%s,%s,%s,%s,%s)"
                 now = datetime.now()
-                def _norm_time(t):
-                    try:
-                        from datetime import datetime as _dt, timedelta as _td
-                        import pandas as _pd
-                        if hasattr(t, 'time'):
-                            return t.time()
-                        if isinstance(t, _td):
-                            return (_dt.min + t).time()
-                        if isinstance(t, _pd.Timedelta):
-                            return (_dt.min + t.to_pytimedelta()).time()
-                        if isinstance(t, str):
-                            try:
-                                return _dt.strptime(t, '%H:%M:%S').time()
-                            except Exception:
-                                return _dt.strptime(t, '%H:%M').time()
-                        return t
-                    except Exception:
-                        return t
-                data_list = [(
-                    r['trade_date'], _norm_time(r['trade_time']), r['code'], r['name'], r['main_action'], r['main_action_semantic'], now, now
-                ) for _, r in df.iterrows()]
-                cursor.executemany(sql, data_list)
+                cols = ['trade_date', 'trade_time', 'code', 'name', 'main_action', 'main_action_semantic']
+                out = df[cols].copy()
+                out['trade_time'] = self._norm_time_series(out['trade_time'])
+                data_list = [(*row, now, now) for row in out.itertuples(index=False, name=None)]
+                # 分批拼接多行VALUES，每批一条INSERT语句
+                for start in range(0, len(data_list), self.insert_batch_size):
+                    chunk = data_list[start:start + self.insert_batch_size]
+                    values_sql = ",".join(cursor.mogrify(row_template, row) for row in chunk)
+                    cursor.execute(insert_sql + values_sql + update_sql)
                 connection.commit()
                 self.logger.info(f"写入分时因子 {len(data_list)} 条")
                 return True
@@ -209,41 +255,53 @@ class IntradayMomentumCalculator:
             if connection:
                 connection.rollback()
             return False
-        finally:
-            if connection:
-                connection.close()
 
     def run_for_date(self, trade_date: str) -> bool:
         try:
             self.logger.info(f"开始计算分时因子: {trade_date}")
             df = self.fetch_5min_data_for_date(trade_date)
-            if df.empty:
-                self.logger.warning(f"{trade_date} 无5分钟数据")
-                return False
-            actions_df = self.build_intraday_actions(df)
-            if actions_df.empty:
-                self.logger.warning(f"{trade_date} 无分时因子")
-                return False
-            if not self.clear_existing_date(trade_date):
-                return False
-            return self.insert_intraday_actions(actions_df)
+            return self._process_date_data(trade_date, df)
         except Exception as e:
             self.logger.error(f"运行分时因子失败: {e}")
             return False
 
+    def _process_date_data(self, trade_date: str, df: pd.DataFrame) -> bool:
+        if df.empty:
+            self.logger.warning(f"{trade_date} 无5分钟数据")
+            return False
+        actions_df = self.build_intraday_actions(df)
+        if actions_df.empty:
+            self.logger.warning(f"{trade_date} 无分时因子")
+            return False
+        if not self.clear_existing_date(trade_date):
+            return False
+        return self.insert_intraday_actions(actions_df)
+
     def run_range(self, start_date: str, end_date: str) -> bool:
         dates = self.get_trade_dates_in_range(start_date, end_date)
         if not dates:
             self.logger.warning("指定区间无交易日")
             return False
         ok_count = 0
-        for d in dates:
-            if self.run_for_date(d):
-                ok_count += 1
+        # 按固定交易日数分段查询，每段按交易日分组处理后即释放，内存占用与区间长度无关
+        for start in range(0, len(dates), self.range_chunk_days):
+            chunk_dates = dates[start:start + self.range_chunk_days]
+            df = self.fetch_5min_data_range(chunk_dates[0], chunk_dates[-1])
+            groups = {
+                (d.strftime('%Y-%m-%d') if hasattr(d, 'strftime') else str(d)): g
+                for d, g in df.groupby('trade_date', sort=True)
+            } if not df.empty else {}
+            del df
+            for d in chunk_dates:
+                try:
+                    self.logger.info(f"开始计算分时因子: {d}")
+                    if self._process_date_data(d, groups.pop(d, pd.DataFrame())):
+                        ok_count += 1
+                except Exception as e:
+                    self.logger.error(f"运行{d}分时因子失败: {e}")
         self.logger.info(f"区间处理完成: 成功 {ok_count}/{len(dates)} 天")
         return ok_count > 0
 
-
 def main():
     import argparse
     parser = argparse.ArgumentParser(description='分时动量因子计算')
@@ -253,15 +311,17 @@ def main():
     args = parser.parse_args()
 
     calc = IntradayMomentumCalculator()
-    if args.date:
-        ok = calc.run_for_date(args.date)
-        sys.exit(0 if ok else 1)
-    if args.start_date and args.end_date:
-        ok = calc.run_range(args.start_date, args.end_date)
-        sys.exit(0 if ok else 1)
-    # 默认跑最近交易日
-    today = datetime.now().strftime('%Y-%m-%d')
-    ok = calc.run_for_date(today)
+    try:
+        if args.date:
+            ok = calc.run_for_date(args.date)
+        elif args.start_date and args.end_date:
+            ok = calc.run_range(args.start_date, args.end_date)
+        else:
+            # 默认跑最近交易日
+            today = datetime.now().strftime('%Y-%m-%d')
+            ok = calc.run_for_date(today)
+    finally:
+        calc.close()
     sys.exit(0 if ok else 1)
 
 
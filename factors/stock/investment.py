@@ -8,8 +8,9 @@
 import os
 import sys
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
 import pymysql
 from dataclasses import dataclass
 
@@ -28,6 +29,10 @@ class InvestmentFactorCalculator:
         """
         self.db_config = config.database
         self.logger = self._setup_logger()
+        self.commit_batch_size = 50  # 逐日计算时每批提交的日期数
+        self.lock_retry_times = 3  # 并发逐日计算遇到死锁时的最多尝试次数
+        self._factor_sql_cache: Dict[int, Tuple[str, str]] = {}  # 按top_n缓存的逐日SQL
+        self._has_unique_key: Optional[bool] = None  # 投资因子表是否有(trade_date, code)唯一键，首次使用时检查
     
     def _setup_logger(self) -> logging.Logger:
         """设置日志"""
@@ -61,258 +66,404 @@ class InvestmentFactorCalculator:
             self.logger.error(f"数据库连接失败: {e}")
             raise
     
-    def get_latest_trade_date(self) -> Optional[str]:
+    @contextmanager
+    def _cursor(self, connection: pymysql.Connection = None, cursor_class=None):
+        """
+        游标上下文管理器：出错时回滚并继续抛出，自行创建的连接在退出时关闭
+        
+        Args:
+            connection: 复用的数据库连接，为None时自行创建并关闭
+            cursor_class: 游标类型，默认元组游标
+            
+        Yields:
+            (连接, 游标)
+        """
+        own_connection = connection is None
+        if own_connection:
+            connection = self._get_db_connection()
+        try:
+            with connection.cursor(cursor_class) as cursor:
+                yield connection, cursor
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            if own_connection:
+                connection.close()
+    
+    def ensure_indexes(self) -> bool:
+        """
+        确保资金流向表存在按日期、净流入排序的覆盖索引，使前N名查询走索引有序扫描而非全量排序；
+        并确保投资因子表存在(trade_date, code)唯一键。
+        建索引会锁表较长时间，只在通过 --ensure-indexes 显式要求时执行，不随日常任务运行
+        
+        Returns:
+            是否成功
+        """
+        try:
+            with self._cursor() as (_, cursor):
+                # 按列判断，已有以(trade_date, net_amount)开头的同类索引时不再重复创建
+                cursor.execute(
+                    """
+                    SELECT index_name FROM information_schema.statistics 
+                    WHERE table_schema = DATABASE() 
+                        AND table_name = 'trade_market_stock_fund_flow' 
+                    GROUP BY index_name 
+                    HAVING GROUP_CONCAT(column_name ORDER BY seq_in_index) LIKE 'trade_date,net_amount%'
+                    """
+                )
+                if not cursor.fetchall():
+                    self.logger.info("创建索引 idx_trade_date_net_amount")
+                    cursor.execute(
+                        """
+                        CREATE INDEX idx_trade_date_net_amount 
+                        ON trade_market_stock_fund_flow (trade_date, net_amount DESC, code, name)
+                        """
+                    )
+                
+                # 投资因子表有(trade_date, code)唯一键时逐日计算才能只删除跌出前N名的记录并原地更新
+                self._has_unique_key = None
+                if not self._check_unique_key(cursor):
+                    self.logger.info("创建唯一键 uk_trade_date_code")
+                    cursor.execute(
+                        """
+                        ALTER TABLE trade_factor_stock_investment 
+                        ADD UNIQUE KEY uk_trade_date_code (trade_date, code)
+                        """
+                    )
+                self._has_unique_key = True
+            return True
+        except Exception as e:
+            self.logger.warning(f"检查索引失败: {e}")
+            return False
+    
+    def get_latest_trade_date(self, connection: pymysql.Connection = None) -> Optional[str]:
         """
         获取最新的交易日期
         
+        Args:
+            connection: 复用的数据库连接，为None时自行创建并关闭
+            
         Returns:
             最新交易日期字符串，格式为YYYY-MM-DD
         """
-        connection = None
         try:
-            connection = self._get_db_connection()
-            with connection.cursor() as cursor:
+            with self._cursor(connection) as (_, cursor):
                 sql = """
-                SELECT MAX(trade_date) as latest_date 
+                SELECT DATE_FORMAT(MAX(trade_date), '%Y-%m-%d') as latest_date 
                 FROM trade_market_stock_fund_flow
                 """
                 cursor.execute(sql)
                 result = cursor.fetchone()
                 
                 if result and result[0]:
-                    return result[0].strftime('%Y-%m-%d') if hasattr(result[0], 'strftime') else str(result[0])
+                    return result[0]
                 return None
                 
         except Exception as e:
             self.logger.error(f"获取最新交易日期失败: {e}")
             return None
-        finally:
-            if connection:
-                connection.close()
     
-    def get_top_fund_inflow_stocks(self, trade_date: str, top_n: int = 500) -> List[Dict[str, Any]]:
+    def _get_factor_sql(self, top_n: int) -> Tuple[str, str]:
         """
-        获取指定日期净流入前N的股票数据
+        获取按top_n特化的删除/写入语句，LIMIT直接写入SQL文本并按top_n缓存，只需绑定交易日期
         
         Args:
-            trade_date: 交易日期，格式为YYYY-MM-DD
-            top_n: 获取前N名，默认500
+            top_n: 获取前N名
             
         Returns:
-            股票数据列表
+            (删除跌出前N名记录的SQL, 写入前N名的SQL)
         """
-        connection = None
-        try:
-            connection = self._get_db_connection()
-            with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-                sql = """
-                SELECT 
-                    trade_date,
-                    code,
-                    name,
-                    net_amount,
-                    pct_change,
-                    close,
-                    ROW_NUMBER() OVER (ORDER BY net_amount DESC) as fund_inflow_rank
+        top_n = int(top_n)
+        if top_n not in self._factor_sql_cache:
+            # 净流入相同时按代码排序，保证删除与写入选出的前N名一致
+            delete_sql = f"""
+            DELETE f FROM trade_factor_stock_investment f
+            LEFT JOIN (
+                SELECT code 
                 FROM trade_market_stock_fund_flow 
                 WHERE trade_date = %s 
                     AND net_amount IS NOT NULL
-                ORDER BY net_amount DESC 
-                LIMIT %s
-                """
-                cursor.execute(sql, (trade_date, top_n))
-                results = cursor.fetchall()
-                
-                self.logger.info(f"获取到 {len(results)} 条 {trade_date} 的资金流向数据")
-                return results
-                
-        except Exception as e:
-            self.logger.error(f"获取资金流向数据失败: {e}")
-            return []
-        finally:
-            if connection:
-                connection.close()
+                ORDER BY net_amount DESC, code 
+                LIMIT {top_n}
+            ) t ON f.code = t.code
+            WHERE f.trade_date = %s AND t.code IS NULL
+            """
+            upsert_sql = f"""
+            INSERT INTO trade_factor_stock_investment 
+            (trade_date, code, name, top_fund_inflow_rank, created_time, updated_time)
+            SELECT 
+                trade_date,
+                code,
+                name,
+                ROW_NUMBER() OVER (ORDER BY net_amount DESC, code) as fund_inflow_rank,
+                NOW(),
+                NOW()
+            FROM trade_market_stock_fund_flow 
+            WHERE trade_date = %s 
+                AND net_amount IS NOT NULL
+            ORDER BY net_amount DESC, code 
+            LIMIT {top_n}
+            ON DUPLICATE KEY UPDATE 
+                name = VALUES(name),
+                top_fund_inflow_rank = VALUES(top_fund_inflow_rank),
+                updated_time = VALUES(updated_time)
+            """
+            self._factor_sql_cache[top_n] = (delete_sql, upsert_sql)
+        return self._factor_sql_cache[top_n]
     
-    def clear_existing_data(self, trade_date: str) -> bool:
+    def _check_unique_key(self, cursor) -> bool:
         """
-        清除指定日期的现有投资因子数据
+        检查投资因子表是否存在(trade_date, code)唯一键，结果在实例内缓存
         
         Args:
-            trade_date: 交易日期
+            cursor: 数据库游标
             
         Returns:
-            是否成功
+            是否存在唯一键，检查失败时按不存在处理
         """
-        connection = None
-        try:
-            connection = self._get_db_connection()
-            with connection.cursor() as cursor:
-                sql = "DELETE FROM trade_factor_stock_investment WHERE trade_date = %s"
-                cursor.execute(sql, (trade_date,))
-                deleted_count = cursor.rowcount
-                connection.commit()
-                
-                self.logger.info(f"清除了 {deleted_count} 条 {trade_date} 的现有投资因子数据")
-                return True
-                
-        except Exception as e:
-            self.logger.error(f"清除现有数据失败: {e}")
-            if connection:
-                connection.rollback()
-            return False
-        finally:
-            if connection:
-                connection.close()
+        if self._has_unique_key is None:
+            try:
+                cursor.execute(
+                    """
+                    SELECT index_name FROM information_schema.statistics 
+                    WHERE table_schema = DATABASE() 
+                        AND table_name = 'trade_factor_stock_investment' 
+                        AND non_unique = 0
+                    GROUP BY index_name 
+                    HAVING GROUP_CONCAT(column_name ORDER BY seq_in_index) = 'trade_date,code'
+                    """
+                )
+                self._has_unique_key = bool(cursor.fetchall())
+            except Exception as e:
+                self.logger.warning("检查投资因子表唯一键失败，按整日删除后写入: %s", e)
+                self._has_unique_key = False
+            if not self._has_unique_key:
+                self.logger.warning("投资因子表缺少(trade_date, code)唯一键，逐日计算改为整日删除后写入")
+        return self._has_unique_key
     
-    def insert_investment_factors(self, fund_flow_data: List[Dict[str, Any]]) -> bool:
+    def _upsert_factor_for_date(self, cursor, trade_date: str, top_n: int = 500) -> int:
         """
-        批量插入投资因子数据
+        在数据库端重算指定日期的投资因子：删除跌出前N名的旧记录，再以INSERT…SELECT…ON DUPLICATE KEY UPDATE
+        写入净流入前N名，未变化的记录原地更新，数据不经过客户端。调用方负责提交或回滚。
+        表上没有(trade_date, code)唯一键时改为整日删除后写入。
         
         Args:
-            fund_flow_data: 资金流向数据列表
+            cursor: 数据库游标
+            trade_date: 交易日期，格式为YYYY-MM-DD
+            top_n: 获取前N名，默认500
             
         Returns:
-            是否成功
+            写入的记录数，没有资金流向数据时为0且不做任何修改
         """
-        if not fund_flow_data:
-            self.logger.warning("没有数据需要插入")
-            return True
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM trade_market_stock_fund_flow 
+            WHERE trade_date = %s AND net_amount IS NOT NULL
+            """,
+            (trade_date,)
+        )
+        source_count = cursor.fetchone()[0]
+        if source_count == 0:
+            return 0
+        
+        delete_sql, upsert_sql = self._get_factor_sql(top_n)
+        if self._check_unique_key(cursor):
+            cursor.execute(delete_sql, (trade_date, trade_date))
+        else:
+            # 没有唯一键时ON DUPLICATE KEY UPDATE不会生效，先清空当日数据再写入，避免重复行
+            cursor.execute("DELETE FROM trade_factor_stock_investment WHERE trade_date = %s", (trade_date,))
+        deleted_count = cursor.rowcount
+        cursor.execute(upsert_sql, (trade_date,))
+        
+        # ON DUPLICATE KEY UPDATE 的 rowcount 对更新计2、未变化计0，这里按实际写入的名次数统计
+        upserted_count = min(source_count, top_n)
+        self.logger.info("%s 清除 %d 条，写入 %d 条投资因子数据", trade_date, deleted_count, upserted_count)
+        return upserted_count
+    
+    def calculate_investment_factor(self, trade_date: str = None, top_n: int = 500,
+                                    connection: pymysql.Connection = None, commit: bool = True) -> bool:
+        """
+        计算投资因子
+        
+        Args:
+            trade_date: 交易日期，默认为最新交易日
+            top_n: 获取前N名，默认500
+            connection: 复用的数据库连接，为None时自行创建并关闭
+            commit: 是否立即提交；为False时由调用方批量提交，出错时抛出异常交由调用方回滚
             
-        connection = None
+        Returns:
+            是否成功
+        """
         try:
-            connection = self._get_db_connection()
-            with connection.cursor() as cursor:
-                sql = """
-                INSERT INTO trade_factor_stock_investment 
-                (trade_date, code, name, top_fund_inflow_rank, created_time, updated_time)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """
+            with self._cursor(connection) as (connection, cursor):
+                # 如果没有指定日期，使用最新交易日
+                if not trade_date:
+                    trade_date = self.get_latest_trade_date(connection)
+                    if not trade_date:
+                        self.logger.error("无法获取最新交易日期")
+                        return False
                 
-                current_time = datetime.now()
-                data_to_insert = []
+                self.logger.debug("开始计算 %s 的投资因子，获取前 %d 名", trade_date, top_n)
                 
-                for item in fund_flow_data:
-                    data_to_insert.append((
-                        item['trade_date'],
-                        item['code'],
-                        item['name'],
-                        item['fund_inflow_rank'],
-                        current_time,
-                        current_time
-                    ))
+                if not commit:
+                    # 批量提交时用保存点撤销单日修改，不影响同批次其他日期
+                    cursor.execute("SAVEPOINT investment_factor_date")
+                inserted_count = self._upsert_factor_for_date(cursor, trade_date, top_n)
                 
-                cursor.executemany(sql, data_to_insert)
-                connection.commit()
+                if inserted_count == 0:
+                    # 没有资金流向数据时保留原有因子数据
+                    if commit:
+                        connection.rollback()
+                    else:
+                        cursor.execute("ROLLBACK TO SAVEPOINT investment_factor_date")
+                    self.logger.warning("%s 没有可用的资金流向数据", trade_date)
+                    return False
                 
-                self.logger.info(f"成功插入 {len(data_to_insert)} 条投资因子数据")
+                if commit:
+                    connection.commit()
+                self.logger.info("投资因子计算完成: %s", trade_date)
                 return True
-                
+            
         except Exception as e:
-            self.logger.error(f"插入投资因子数据失败: {e}")
-            if connection:
-                connection.rollback()
+            self.logger.error("计算投资因子失败: %s", e)
+            if not commit:
+                raise
             return False
-        finally:
-            if connection:
-                connection.close()
     
-    def calculate_investment_factor(self, trade_date: str = None, top_n: int = 500) -> bool:
+    def _calculate_date_with_retry(self, trade_date: str, top_n: int) -> bool:
         """
-        计算投资因子
+        并发逐日计算时在独立连接上计算单日投资因子
+        
+        连接使用READ COMMITTED隔离级别，避免相邻日期在(trade_date, code)索引边界上的间隙锁互相冲突；
+        仍发生死锁或锁等待超时时回滚并重试。
         
         Args:
-            trade_date: 交易日期，默认为最新交易日
-            top_n: 获取前N名，默认500
+            trade_date: 交易日期，格式为YYYY-MM-DD
+            top_n: 获取前N名股票
             
         Returns:
             是否成功
         """
         try:
-            # 如果没有指定日期，使用最新交易日
-            if not trade_date:
-                trade_date = self.get_latest_trade_date()
-                if not trade_date:
-                    self.logger.error("无法获取最新交易日期")
-                    return False
-            
-            self.logger.info(f"开始计算 {trade_date} 的投资因子，获取前 {top_n} 名")
-            
-            # 获取资金流向数据
-            fund_flow_data = self.get_top_fund_inflow_stocks(trade_date, top_n)
-            if not fund_flow_data:
-                self.logger.warning(f"{trade_date} 没有可用的资金流向数据")
-                return False
-            
-            # 清除现有数据
-            if not self.clear_existing_data(trade_date):
-                return False
+            with self._cursor() as (connection, cursor):
+                cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+                for attempt in range(1, self.lock_retry_times + 1):
+                    try:
+                        ok = self.calculate_investment_factor(trade_date, top_n, connection, commit=False)
+                        connection.commit()
+                        return ok
+                    except pymysql.err.OperationalError as e:
+                        connection.rollback()
+                        if e.args[0] not in (1205, 1213) or attempt == self.lock_retry_times:
+                            raise
+                        self.logger.warning("%s 写入发生锁冲突，第 %d 次重试: %s", trade_date, attempt, e)
+        except Exception as e:
+            self.logger.error("计算 %s 投资因子失败: %s", trade_date, e)
+            return False
+    
+    def _calculate_dates(self, trade_dates: List[str], top_n: int, connection: pymysql.Connection,
+                         workers: int = 1) -> int:
+        """
+        逐日计算投资因子
+        
+        Args:
+            trade_dates: 交易日期列表
+            top_n: 获取前N名股票
+            connection: 串行时复用的数据库连接
+            workers: 并发线程数，大于1时各线程使用独立连接
             
-            # 插入新数据
-            if not self.insert_investment_factors(fund_flow_data):
-                return False
+        Returns:
+            成功的天数
+        """
+        total_count = len(trade_dates)
+        
+        if workers > 1 and total_count > 1:
+            # 各日期的删除/写入互不重叠，可并发执行；线程在等待数据库时释放GIL
+            def _run(trade_date: str) -> bool:
+                ok = self._calculate_date_with_retry(trade_date, top_n)
+                if not ok:
+                    self.logger.warning("计算 %s 投资因子失败", trade_date)
+                return ok
             
-            self.logger.info(f"投资因子计算完成: {trade_date}")
-            return True
+            with ThreadPoolExecutor(max_workers=min(workers, total_count)) as executor:
+                return sum(executor.map(_run, trade_dates))
+        
+        # 串行时每commit_batch_size个日期提交一次；批次出错则回滚并逐日单独重算
+        success_count = 0
+        batch_dates = []
+        batch_success = 0
+        for i, trade_date in enumerate(trade_dates, 1):
+            # 进度日志按批次节流，避免长区间逐日刷屏
+            if i == 1 or i % self.commit_batch_size == 0 or i == total_count:
+                self.logger.info("处理第 %d/%d 个交易日: %s", i, total_count, trade_date)
+            batch_dates.append(trade_date)
             
-        except Exception as e:
-            self.logger.error(f"计算投资因子失败: {e}")
-            return False
+            try:
+                if self.calculate_investment_factor(trade_date, top_n, connection, commit=False):
+                    batch_success += 1
+                else:
+                    self.logger.warning("计算 %s 投资因子失败", trade_date)
+                
+                if len(batch_dates) >= self.commit_batch_size or i == total_count:
+                    connection.commit()
+                    success_count += batch_success
+                    batch_dates = []
+                    batch_success = 0
+            except Exception as e:
+                self.logger.warning("批次提交失败，回滚后逐日重算 %d 个交易日: %s", len(batch_dates), e)
+                connection.rollback()
+                for retry_date in batch_dates:
+                    if self.calculate_investment_factor(retry_date, top_n, connection):
+                        success_count += 1
+                    else:
+                        self.logger.warning("计算 %s 投资因子失败", retry_date)
+                batch_dates = []
+                batch_success = 0
+        return success_count
     
-    def calculate_recent_days(self, days: int = 5, top_n: int = 500) -> bool:
+    def calculate_recent_days(self, days: int = 5, top_n: int = 500, workers: int = 1) -> bool:
         """
         计算最近N天的投资因子
         
         Args:
             days: 天数
             top_n: 获取前N名股票，默认500
+            workers: 并发线程数，默认1（串行）
             
         Returns:
             是否成功
         """
         try:
-            latest_date = self.get_latest_trade_date()
-            if not latest_date:
-                self.logger.error("无法获取最新交易日期")
-                return False
-            
-            # 获取最近的交易日期列表
-            connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_fund_flow 
-                    WHERE trade_date <= %s 
-                    ORDER BY trade_date DESC 
-                    LIMIT %s
-                    """
-                    cursor.execute(sql, (latest_date, days))
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-            finally:
-                connection.close()
-            
-            success_count = 0
-            total_count = len(trade_dates)
-            
-            for i, trade_date in enumerate(trade_dates, 1):
-                self.logger.info(f"处理第 {i}/{total_count} 个交易日: {trade_date}")
+            # 整个批次复用同一个连接
+            with self._cursor() as (connection, cursor):
+                # 一次查询直接取最近N个交易日，无需先查最新日期
+                sql = """
+                SELECT DISTINCT DATE_FORMAT(trade_date, '%%Y-%%m-%%d') as trade_date 
+                FROM trade_market_stock_fund_flow 
+                ORDER BY trade_date DESC 
+                LIMIT %s
+                """
+                cursor.execute(sql, (days,))
+                trade_dates = [row[0] for row in cursor.fetchall()]
                 
-                if self.calculate_investment_factor(trade_date, top_n):
-                    success_count += 1
-                else:
-                    self.logger.warning(f"计算 {trade_date} 投资因子失败")
+                if not trade_dates:
+                    self.logger.error("无法获取最新交易日期")
+                    return False
+                
+                total_count = len(trade_dates)
+                success_count = self._calculate_dates(trade_dates, top_n, connection, workers)
             
-            self.logger.info(f"完成最近 {days} 天的投资因子计算，成功 {success_count}/{total_count} 天")
+            self.logger.info("完成最近 %d 天的投资因子计算，成功 %d/%d 天", days, success_count, total_count)
             return success_count > 0
             
         except Exception as e:
-            self.logger.error(f"计算最近几天投资因子失败: {e}")
+            self.logger.error("计算最近几天投资因子失败: %s", e)
             return False
     
-    def update_factor_data(self, start_date: str = None, end_date: str = None, top_n: int = 500) -> bool:
+    def update_factor_data_bulk(self, start_date: str = None, end_date: str = None, top_n: int = 500) -> bool:
         """
-        更新投资因子数据
+        批量更新投资因子数据：一次区间删除加一条按日期分区排名的INSERT…SELECT，单次提交
         
         Args:
             start_date: 开始日期 (YYYY-MM-DD)，可选，为None时更新全部数据
@@ -324,89 +475,147 @@ class InvestmentFactorCalculator:
         """
         try:
             if start_date and end_date:
-                self.logger.info(f"开始更新投资因子数据: {start_date} 到 {end_date}")
-                # 获取指定日期范围内的交易日期
-                trade_dates = self._get_trade_dates_in_range(start_date, end_date)
+                self.logger.info("开始批量更新投资因子数据: %s 到 %s", start_date, end_date)
+                date_filter = "AND trade_date BETWEEN %s AND %s"
+                date_params = (start_date, end_date)
             else:
-                self.logger.info("开始更新全部投资因子数据")
-                # 获取全部交易日期
-                trade_dates = self._get_all_trade_dates()
+                self.logger.info("开始批量更新全部投资因子数据")
+                date_filter = ""
+                date_params = ()
+            
+            with self._cursor() as (connection, cursor):
+                # 只清除有资金流向数据的日期，与逐日计算的行为保持一致
+                delete_sql = f"""
+                DELETE f FROM trade_factor_stock_investment f
+                JOIN (
+                    SELECT DISTINCT trade_date 
+                    FROM trade_market_stock_fund_flow 
+                    WHERE net_amount IS NOT NULL {date_filter}
+                ) d ON f.trade_date = d.trade_date
+                """
+                cursor.execute(delete_sql, date_params)
+                deleted_count = cursor.rowcount
+                
+                insert_sql = f"""
+                INSERT INTO trade_factor_stock_investment 
+                (trade_date, code, name, top_fund_inflow_rank, created_time, updated_time)
+                SELECT trade_date, code, name, fund_inflow_rank, NOW(), NOW()
+                FROM (
+                    SELECT 
+                        trade_date,
+                        code,
+                        name,
+                        ROW_NUMBER() OVER (PARTITION BY trade_date ORDER BY net_amount DESC, code) as fund_inflow_rank
+                    FROM trade_market_stock_fund_flow 
+                    WHERE net_amount IS NOT NULL {date_filter}
+                ) ranked
+                WHERE fund_inflow_rank <= %s
+                """
+                cursor.execute(insert_sql, date_params + (top_n,))
+                inserted_count = cursor.rowcount
+                connection.commit()
             
-            if not trade_dates:
-                self.logger.warning("未获取到交易日期数据")
-                return False
+            self.logger.info("投资因子数据批量更新完成: 清除 %d 条，写入 %d 条", deleted_count, inserted_count)
+            return inserted_count > 0
             
-            success_count = 0
-            total_count = len(trade_dates)
+        except Exception as e:
+            self.logger.error("批量更新投资因子数据失败: %s", e)
+            return False
+    
+    def update_factor_data(self, start_date: str = None, end_date: str = None, top_n: int = 500,
+                           per_date: bool = False, workers: int = 1) -> bool:
+        """
+        更新投资因子数据
+        
+        Args:
+            start_date: 开始日期 (YYYY-MM-DD)，可选，为None时更新全部数据
+            end_date: 结束日期 (YYYY-MM-DD)，可选，为None时更新全部数据
+            top_n: 获取前N名股票，默认500
+            per_date: 是否逐日计算，默认使用批量SQL一次完成
+            workers: 逐日计算时的并发线程数，默认1（串行）
             
-            for i, trade_date in enumerate(trade_dates, 1):
-                self.logger.info(f"处理第 {i}/{total_count} 个交易日: {trade_date}")
-                
-                if self.calculate_investment_factor(trade_date, top_n):
-                    success_count += 1
+        Returns:
+            更新是否成功
+        """
+        if not per_date:
+            return self.update_factor_data_bulk(start_date, end_date, top_n)
+        
+        try:
+            # 整个批次复用同一个连接
+            with self._cursor() as (connection, _):
+                if start_date and end_date:
+                    self.logger.info("开始更新投资因子数据: %s 到 %s", start_date, end_date)
+                    # 获取指定日期范围内的交易日期
+                    trade_dates = self._get_trade_dates_in_range(start_date, end_date, connection)
                 else:
-                    self.logger.warning(f"计算 {trade_date} 投资因子失败")
+                    self.logger.info("开始更新全部投资因子数据")
+                    # 获取全部交易日期
+                    trade_dates = self._get_all_trade_dates(connection)
+                
+                if not trade_dates:
+                    self.logger.warning("未获取到交易日期数据")
+                    return False
+                
+                total_count = len(trade_dates)
+                success_count = self._calculate_dates(trade_dates, top_n, connection, workers)
             
-            self.logger.info(f"投资因子数据更新完成: 成功 {success_count}/{total_count} 天")
+            self.logger.info("投资因子数据更新完成: 成功 %d/%d 天", success_count, total_count)
             return success_count > 0
             
         except Exception as e:
-            self.logger.error(f"更新投资因子数据失败: {e}")
+            self.logger.error("更新投资因子数据失败: %s", e)
             return False
     
-    def _get_trade_dates_in_range(self, start_date: str, end_date: str) -> List[str]:
+    def _get_trade_dates_in_range(self, start_date: str, end_date: str,
+                                  connection: pymysql.Connection = None) -> List[str]:
         """
         获取指定日期范围内的交易日期
         
         Args:
             start_date: 开始日期
             end_date: 结束日期
+            connection: 复用的数据库连接，为None时自行创建并关闭
             
         Returns:
             交易日期列表
         """
         try:
-            connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_fund_flow 
-                    WHERE trade_date >= %s AND trade_date <= %s
-                    ORDER BY trade_date ASC
-                    """
-                    cursor.execute(sql, (start_date, end_date))
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-                    return trade_dates
-            finally:
-                connection.close()
+            # 无缓冲游标逐行读取，不在客户端先缓存整个结果集
+            with self._cursor(connection, pymysql.cursors.SSCursor) as (_, cursor):
+                sql = """
+                SELECT DISTINCT DATE_FORMAT(trade_date, '%%Y-%%m-%%d') as trade_date 
+                FROM trade_market_stock_fund_flow 
+                WHERE trade_date >= %s AND trade_date <= %s
+                ORDER BY trade_date ASC
+                """
+                cursor.execute(sql, (start_date, end_date))
+                trade_dates = [row[0] for row in cursor]
+                return trade_dates
         except Exception as e:
             self.logger.error(f"获取指定日期范围交易日期失败: {e}")
             return []
     
-    def _get_all_trade_dates(self) -> List[str]:
+    def _get_all_trade_dates(self, connection: pymysql.Connection = None) -> List[str]:
         """
         获取全部交易日期
         
+        Args:
+            connection: 复用的数据库连接，为None时自行创建并关闭
+            
         Returns:
             交易日期列表
         """
         try:
-            connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_fund_flow 
-                    ORDER BY trade_date ASC
-                    """
-                    cursor.execute(sql)
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-                    return trade_dates
-            finally:
-                connection.close()
+            # 无缓冲游标逐行读取，不在客户端先缓存整个结果集
+            with self._cursor(connection, pymysql.cursors.SSCursor) as (_, cursor):
+                sql = """
+                SELECT DISTINCT DATE_FORMAT(trade_date, '%Y-%m-%d') as trade_date 
+                FROM trade_market_stock_fund_flow 
+                ORDER BY trade_date ASC
+                """
+                cursor.execute(sql)
+                trade_dates = [row[0] for row in cursor]
+                return trade_dates
         except Exception as e:
             self.logger.error(f"获取全部交易日期失败: {e}")
             return []
@@ -423,27 +632,32 @@ def main():
     parser.add_argument('--top', '-t', type=int, default=500, help='获取前N名 (默认500)')
     parser.add_argument('--days', type=int, help='计算最近N天')
     parser.add_argument('--all', action='store_true', help='更新全部数据')
+    parser.add_argument('--per-date', action='store_true', help='逐日计算（默认按区间批量计算）')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='逐日计算时的并发线程数 (默认1)')
+    parser.add_argument('--ensure-indexes', action='store_true', help='检查并创建所需索引（一次性迁移，不随日常任务执行）')
     
     args = parser.parse_args()
     
     try:
         calculator = InvestmentFactorCalculator()
+        if args.ensure_indexes:
+            calculator.ensure_indexes()
         
         if args.all:
             # 更新全部数据
-            success = calculator.update_factor_data(top_n=args.top)
+            success = calculator.update_factor_data(top_n=args.top, per_date=args.per_date, workers=args.workers)
         elif args.start_date and args.end_date:
             # 更新指定日期范围的数据
-            success = calculator.update_factor_data(args.start_date, args.end_date, args.top)
+            success = calculator.update_factor_data(args.start_date, args.end_date, args.top, per_date=args.per_date, workers=args.workers)
         elif args.days:
             # 计算最近N天（保持向后兼容）
-            success = calculator.calculate_recent_days(args.days)
+            success = calculator.calculate_recent_days(args.days, workers=args.workers)
         elif args.date:
             # 计算单独某一天（保持向后兼容）
             success = calculator.calculate_investment_factor(args.date, args.top)
         else:
             # 默认更新全部数据
-            success = calculator.update_factor_data(top_n=args.top)
+            success = calculator.update_factor_data(top_n=args.top, per_date=args.per_date, workers=args.workers)
         
         if success:
             print("投资因子计算完成")
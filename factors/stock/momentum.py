@@ -8,10 +8,9 @@
 import os
 import sys
 import logging
-import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import pymysql
 from dataclasses import dataclass
 
@@ -29,8 +28,14 @@ class MomentumFactorCalculator:
         初始化动量因子计算器
         """
         self.db_config = config.database
+        self._local = threading.local()  # 每个线程复用各自的数据库连接
         self.logger = self._setup_logger()
         self.window_size = 7  # 7日窗口
+        # 计算窗口时向前取行情的自然日数，覆盖长假后仍有完整窗口；
+        # 单日与批量计算统一规则：最近window_size条有效行情须全部落在当日前lookback_days天内，
+        # 否则（如长期停牌后刚复牌）不产生因子值
+        self.lookback_days = 30
+        self.commit_batch_size = 50  # 逐日计算时每批提交的日期数
     
     def _setup_logger(self) -> logging.Logger:
         """设置日志"""
@@ -48,8 +53,12 @@ class MomentumFactorCalculator:
         return logger
     
     def _get_db_connection(self) -> pymysql.Connection:
-        """获取数据库连接"""
+        """获取当前线程复用的数据库连接，断线时自动重连"""
         try:
+            connection = getattr(self._local, 'connection', None)
+            if connection is not None:
+                connection.ping(reconnect=True)
+                return connection
             connection = pymysql.connect(
                 host=self.db_config.host,
                 port=self.db_config.port,
@@ -59,11 +68,56 @@ class MomentumFactorCalculator:
                 charset=self.db_config.charset,
                 autocommit=False
             )
+            self._local.connection = connection
             return connection
         except Exception as e:
             self.logger.error(f"数据库连接失败: {e}")
             raise
     
+    def close(self):
+        """关闭当前线程的数据库连接"""
+        connection = getattr(self._local, 'connection', None)
+        if connection:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            self._local.connection = None
+    
+    def ensure_indexes(self) -> bool:
+        """
+        确保日线行情表存在以(trade_date, code)开头的索引，
+        使窗口计算按日期范围扫描而非遍历全部历史。
+        建索引会锁表较长时间，只在通过 --ensure-indexes 显式要求时执行，不随日常任务运行
+        
+        Returns:
+            是否成功
+        """
+        try:
+            connection = self._get_db_connection()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT index_name FROM information_schema.statistics 
+                    WHERE table_schema = DATABASE() 
+                        AND table_name = 'trade_market_stock_daily' 
+                    GROUP BY index_name 
+                    HAVING GROUP_CONCAT(column_name ORDER BY seq_in_index) LIKE 'trade_date,code%'
+                    """
+                )
+                if not cursor.fetchall():
+                    self.logger.info("创建索引 idx_trade_date_code")
+                    cursor.execute(
+                        """
+                        CREATE INDEX idx_trade_date_code 
+                        ON trade_market_stock_daily (trade_date, code)
+                        """
+                    )
+            return True
+        except Exception as e:
+            self.logger.warning(f"检查索引失败: {e}")
+            return False
+    
     def get_latest_trade_date(self) -> Optional[str]:
         """
         获取最新的交易日期
@@ -89,199 +143,61 @@ class MomentumFactorCalculator:
         except Exception as e:
             self.logger.error(f"获取最新交易日期失败: {e}")
             return None
-        finally:
-            if connection:
-                connection.close()
     
-    def get_stock_data_for_window(self, trade_date: str, window_size: int = 7) -> pd.DataFrame:
+    def _get_divergence_sql(self) -> str:
         """
-        获取指定日期前N个交易日的股票数据（用于计算窗口内的量价背离度）
+        构造按股票计算窗口内量价背离度的查询
+        
+        按股票聚合最近window_size天的价格与成交量的和、平方和及乘积和，
+        用闭式公式求皮尔逊相关系数，每只股票一行结果。
+        价格使用high+low+close，与典型价格只差常数倍，不影响相关系数。
+        只扫描目标日期前lookback_days天的行情，使trade_date上的索引可以走范围扫描；
+        该范围内有效行情不足window_size条的股票不输出，不再回溯更早的行情。
+        与区间批量计算的规则一致：只输出在目标日期有有效行情的股票，停牌股票不输出。
+        参数依次为 (trade_date, lookback_days, trade_date, window_size, window_size, trade_date)。
         
-        Args:
-            trade_date: 目标交易日期，格式为YYYY-MM-DD
-            window_size: 窗口大小，默认7天
-            
         Returns:
-            包含股票数据的DataFrame
+            输出 code, name, divergence 三列的SQL
         """
-        connection = None
-        try:
-            connection = self._get_db_connection()
-            with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-                # 使用子查询获取每只股票最近window_size天的数据
-                sql = """
+        # 样本不足、价格缺失、当日无行情或零方差的股票不输出
+        return """
+        SELECT 
+            code,
+            name,
+            (n * sxy - sx * sy) / SQRT((n * sxx - sx * sx) * (n * syy - sy * sy)) AS divergence
+        FROM (
+            SELECT 
+                code,
+                MAX(CASE WHEN rn = 1 THEN name END) AS name,
+                MAX(CASE WHEN rn = 1 THEN trade_date END) AS last_date,
+                COUNT(tp) AS n,
+                SUM(tp) AS sx,
+                SUM(vol) AS sy,
+                SUM(tp * vol) AS sxy,
+                SUM(tp * tp) AS sxx,
+                SUM(vol * vol) AS syy
+            FROM (
                 SELECT 
                     trade_date,
                     code,
                     name,
-                    open,
-                    high,
-                    low,
-                    close,
+                    high + low + close AS tp,
                     vol,
-                    amount
-                FROM (
-                    SELECT 
-                        trade_date,
-                        code,
-                        name,
-                        open,
-                        high,
-                        low,
-                        close,
-                        vol,
-                        amount,
-                        ROW_NUMBER() OVER (PARTITION BY code ORDER BY trade_date DESC) as rn
-                    FROM trade_market_stock_daily 
-                    WHERE trade_date <= %s 
-                        AND vol > 0 
-                        AND amount > 0
-                        AND close > 0
-                ) ranked_data
-                WHERE rn <= %s
-                ORDER BY code, trade_date DESC
-                """
-                cursor.execute(sql, (trade_date, window_size))
-                results = cursor.fetchall()
-                
-                if not results:
-                    self.logger.warning(f"未获取到 {trade_date} 及之前 {window_size} 天的股票数据")
-                    return pd.DataFrame()
-                
-                df = pd.DataFrame(results)
-                self.logger.info(f"获取到 {len(df)} 条股票数据（窗口大小: {window_size}天），用于计算 {trade_date} 的量价背离度")
-                return df
-                
-        except Exception as e:
-            self.logger.error(f"获取股票数据失败: {e}")
-            return pd.DataFrame()
-        finally:
-            if connection:
-                connection.close()
-    
-    def calculate_vwap(self, prices: np.ndarray, volumes: np.ndarray) -> float:
-        """
-        计算成交量加权平均价格 (VWAP)
-        
-        Args:
-            prices: 价格数组
-            volumes: 成交量数组
-            
-        Returns:
-            VWAP值
+                    ROW_NUMBER() OVER (PARTITION BY code ORDER BY trade_date DESC) as rn
+                FROM trade_market_stock_daily 
+                WHERE trade_date BETWEEN DATE_SUB(%s, INTERVAL %s DAY) AND %s 
+                    AND vol > 0 
+                    AND amount > 0
+                    AND close > 0
+            ) ranked_data
+            WHERE rn <= %s
+            GROUP BY code
+        ) window_stats
+        WHERE n >= %s
+            AND last_date = %s
+            AND n * sxx - sx * sx > 0
+            AND n * syy - sy * sy > 0
         """
-        if len(prices) == 0 or len(volumes) == 0 or np.sum(volumes) == 0:
-            return np.nan
-        
-        return np.sum(prices * volumes) / np.sum(volumes)
-    
-    def calculate_volume_price_divergence(self, stock_data: pd.DataFrame, window_size: int = 7) -> float:
-        """
-        计算量价背离度（7日窗口内VWAP与成交量的皮尔逊相关系数）
-        
-        Args:
-            stock_data: 单只股票的历史数据，按日期降序排列
-            window_size: 窗口大小，默认7天
-            
-        Returns:
-            量价背离度（皮尔逊相关系数）
-        """
-        try:
-            if len(stock_data) < window_size:
-                return np.nan
-            
-            # 取最近window_size天的数据
-            recent_data = stock_data.head(window_size).copy()
-            recent_data = recent_data.sort_values('trade_date')  # 按日期升序排列
-            
-            # 确保数值列为float类型
-            numeric_columns = ['open', 'high', 'low', 'close', 'vol', 'amount']
-            for col in numeric_columns:
-                if col in recent_data.columns:
-                    recent_data[col] = pd.to_numeric(recent_data[col], errors='coerce')
-            
-            # 计算每日的VWAP（这里使用典型价格作为代理）
-            # 典型价格 = (high + low + close) / 3
-            recent_data['typical_price'] = (recent_data['high'] + recent_data['low'] + recent_data['close']) / 3
-            
-            # 提取VWAP和成交量数据
-            vwap_values = recent_data['typical_price'].values.astype(float)
-            volume_values = recent_data['vol'].values.astype(float)
-            
-            # 检查数据有效性
-            if len(vwap_values) < 2 or len(volume_values) < 2:
-                return np.nan
-            
-            # 检查是否有NaN值
-            if np.any(np.isnan(vwap_values)) or np.any(np.isnan(volume_values)):
-                return np.nan
-            
-            # 检查是否有零方差
-            if np.std(vwap_values) == 0 or np.std(volume_values) == 0:
-                return np.nan
-            
-            # 计算皮尔逊相关系数
-            correlation = np.corrcoef(vwap_values, volume_values)[0, 1]
-            
-            return float(correlation) if not np.isnan(correlation) else np.nan
-            
-        except Exception as e:
-            self.logger.error(f"计算量价背离度失败: {e}")
-            return np.nan
-    
-    def calculate_momentum_factors_for_date(self, trade_date: str) -> List[Dict[str, Any]]:
-        """
-        计算指定日期所有股票的动量因子
-        
-        Args:
-            trade_date: 交易日期，格式为YYYY-MM-DD
-            
-        Returns:
-            动量因子数据列表
-        """
-        try:
-            # 获取股票数据
-            stock_data = self.get_stock_data_for_window(trade_date, self.window_size)
-            if stock_data.empty:
-                self.logger.warning(f"{trade_date} 没有可用的股票数据")
-                return []
-            
-            # 按股票代码分组计算
-            momentum_factors = []
-            stock_groups = stock_data.groupby('code')
-            
-            total_stocks = len(stock_groups)
-            processed_count = 0
-            
-            for code, group_data in stock_groups:
-                try:
-                    # 计算量价背离度
-                    divergence = self.calculate_volume_price_divergence(group_data, self.window_size)
-                    
-                    if not np.isnan(divergence):
-                        stock_name = group_data.iloc[0]['name']
-                        
-                        momentum_factors.append({
-                            'trade_date': trade_date,
-                            'code': code,
-                            'name': stock_name,
-                            'volume_price_divergence_5d': round(divergence, 4)
-                        })
-                    
-                    processed_count += 1
-                    if processed_count % 500 == 0:
-                        self.logger.info(f"已处理 {processed_count}/{total_stocks} 只股票")
-                        
-                except Exception as e:
-                    self.logger.warning(f"计算股票 {code} 的动量因子失败: {e}")
-                    continue
-            
-            self.logger.info(f"完成 {trade_date} 的动量因子计算，共 {len(momentum_factors)} 只股票")
-            return momentum_factors
-            
-        except Exception as e:
-            self.logger.error(f"计算 {trade_date} 动量因子失败: {e}")
-            return []
     
     def clear_existing_data(self, trade_date: str = None, start_date: str = None, end_date: str = None) -> bool:
         """
@@ -326,72 +242,52 @@ class MomentumFactorCalculator:
             if connection:
                 connection.rollback()
             return False
-        finally:
-            if connection:
-                connection.close()
     
-    def insert_momentum_factors(self, momentum_data: List[Dict[str, Any]]) -> bool:
+    def _refresh_factor_for_date(self, cursor, trade_date: str, clear_existing: bool = True) -> int:
         """
-        批量插入动量因子数据
+        用INSERT ... SELECT重新生成单个交易日的动量因子数据
+        
+        先清除该日期的旧数据再由数据库直接计算写入，不提交事务，
+        由调用方决定提交或回滚。
         
         Args:
-            momentum_data: 动量因子数据列表
+            cursor: 数据库游标
+            trade_date: 交易日期，格式为YYYY-MM-DD
+            clear_existing: 是否先清除该日期的旧数据，调用方已整段清除时传False
             
         Returns:
-            是否成功
+            写入的记录数
         """
-        if not momentum_data:
-            self.logger.warning("没有数据需要插入")
-            return True
-            
-        connection = None
-        try:
-            connection = self._get_db_connection()
-            with connection.cursor() as cursor:
-                sql = """
-                INSERT INTO trade_factor_stock_momentum 
-                (trade_date, code, name, volume_price_divergence_5d, created_time, updated_time)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """
-                
-                current_time = datetime.now()
-                data_to_insert = []
-                
-                for item in momentum_data:
-                    data_to_insert.append((
-                        item['trade_date'],
-                        item['code'],
-                        item['name'],
-                        item['volume_price_divergence_5d'],
-                        current_time,
-                        current_time
-                    ))
-                
-                cursor.executemany(sql, data_to_insert)
-                connection.commit()
-                
-                self.logger.info(f"成功插入 {len(data_to_insert)} 条动量因子数据")
-                return True
-                
-        except Exception as e:
-            self.logger.error(f"插入动量因子数据失败: {e}")
-            if connection:
-                connection.rollback()
-            return False
-        finally:
-            if connection:
-                connection.close()
+        if clear_existing:
+            cursor.execute("DELETE FROM trade_factor_stock_momentum WHERE trade_date = %s", (trade_date,))
+        
+        sql = f"""
+        INSERT INTO trade_factor_stock_momentum 
+        (trade_date, code, name, volume_price_divergence_5d, created_time, updated_time)
+        SELECT 
+            %s,
+            code,
+            name,
+            ROUND(divergence, 4),
+            NOW(),
+            NOW()
+        FROM ({self._get_divergence_sql()}) divergence_data
+        """
+        cursor.execute(sql, (trade_date, trade_date, self.lookback_days, trade_date, self.window_size, self.window_size, trade_date))
+        return cursor.rowcount
     
-    def calculate_momentum_factor(self, trade_date: str = None) -> bool:
+    def calculate_momentum_factor(self, trade_date: str = None, clear_existing: bool = True) -> bool:
         """
         计算动量因子
         
         Args:
             trade_date: 交易日期，默认为最新交易日
+            clear_existing: 是否先清除该日期的旧数据，调用方已整段清除时传False
             
         Returns:
             是否成功
         """
+        connection = None
         try:
             # 如果没有指定日期，使用最新交易日
             if not trade_date:
@@ -402,25 +298,25 @@ class MomentumFactorCalculator:
             
             self.logger.info(f"开始计算 {trade_date} 的动量因子")
             
-            # 计算动量因子
-            momentum_data = self.calculate_momentum_factors_for_date(trade_date)
-            if not momentum_data:
-                self.logger.warning(f"{trade_date} 没有可用的动量因子数据")
-                return False
-            
-            # 清除现有数据
-            if not self.clear_existing_data(trade_date):
-                return False
-            
-            # 插入新数据
-            if not self.insert_momentum_factors(momentum_data):
-                return False
+            # 在数据库内完成计算与写入，清除和插入在同一事务中
+            connection = self._get_db_connection()
+            with connection.cursor() as cursor:
+                inserted_count = self._refresh_factor_for_date(cursor, trade_date, clear_existing)
+                if inserted_count == 0:
+                    # 没有新数据时保留原有数据
+                    connection.rollback()
+                    self.logger.warning(f"{trade_date} 没有可用的动量因子数据")
+                    return False
+            connection.commit()
             
+            self.logger.info(f"成功写入 {inserted_count} 条 {trade_date} 的动量因子数据")
             self.logger.info(f"动量因子计算完成: {trade_date}")
             return True
             
         except Exception as e:
             self.logger.error(f"计算动量因子失败: {e}")
+            if connection:
+                connection.rollback()
             return False
     
     def calculate_recent_days(self, days: int = 5) -> bool:
@@ -441,50 +337,147 @@ class MomentumFactorCalculator:
             
             # 获取最近的交易日期列表
             connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_daily 
-                    WHERE trade_date <= %s 
-                    ORDER BY trade_date DESC 
-                    LIMIT %s
-                    """
-                    cursor.execute(sql, (latest_date, days))
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-            finally:
-                connection.close()
+            with connection.cursor() as cursor:
+                sql = """
+                SELECT DISTINCT trade_date 
+                FROM trade_market_stock_daily 
+                WHERE trade_date <= %s 
+                ORDER BY trade_date DESC 
+                LIMIT %s
+                """
+                cursor.execute(sql, (latest_date, days))
+                trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
+                             for row in cursor.fetchall()]
             
-            success_count = 0
-            total_count = len(trade_dates)
+            if not trade_dates:
+                self.logger.warning("未获取到交易日期数据")
+                return False
+            
+            # 最近N天是连续区间，一次批量计算
+            return self.update_factor_data_bulk(trade_dates[-1], trade_dates[0])
+            
+        except Exception as e:
+            self.logger.error(f"计算最近几天动量因子失败: {e}")
+            return False
+    
+    def update_factor_data_bulk(self, start_date: str = None, end_date: str = None) -> bool:
+        """
+        批量更新动量因子数据：按股票滚动窗口一次计算区间内所有交易日，单次提交
+        
+        每只股票只在其有有效行情的交易日产生因子值；停牌日不再沿用停牌前的数据。
+        窗口内最早一条行情早于当日lookback_days天的（如长期停牌后刚复牌）不产生因子值，
+        与按日计算的结果一致。
+        
+        Args:
+            start_date: 开始日期 (YYYY-MM-DD)，可选，为None时更新全部数据
+            end_date: 结束日期 (YYYY-MM-DD)，可选，为None时更新全部数据
             
-            for i, trade_date in enumerate(trade_dates, 1):
-                self.logger.info(f"处理第 {i}/{total_count} 个交易日: {trade_date}")
+        Returns:
+            更新是否成功
+        """
+        connection = None
+        try:
+            if start_date and end_date:
+                self.logger.info(f"开始批量更新动量因子数据: {start_date} 到 {end_date}")
+                # 向前多取lookback_days天的行情，使区间首日也有完整窗口；
+                # 这里只缩小扫描范围，逐行的lookback_days截止在窗口计算后判断，--all同样适用
+                source_filter = "AND trade_date BETWEEN DATE_SUB(%s, INTERVAL %s DAY) AND %s"
+                source_params = (start_date, self.lookback_days, end_date)
+                range_filter = "AND trade_date BETWEEN %s AND %s"
+                range_params = (start_date, end_date)
+                delete_sql = "DELETE FROM trade_factor_stock_momentum WHERE trade_date BETWEEN %s AND %s"
+            else:
+                self.logger.info("开始批量更新全部动量因子数据")
+                source_filter = ""
+                source_params = ()
+                range_filter = ""
+                range_params = ()
+                delete_sql = "DELETE FROM trade_factor_stock_momentum"
+            
+            connection = self._get_db_connection()
+            with connection.cursor() as cursor:
+                cursor.execute(delete_sql, range_params)
+                deleted_count = cursor.rowcount
                 
-                if self.calculate_momentum_factor(trade_date):
-                    success_count += 1
-                else:
-                    self.logger.warning(f"计算 {trade_date} 动量因子失败")
+                # 每行取该股票截至当日的最近window_size条记录求和，再用闭式公式求相关系数；
+                # 窗口最早一条须在当日前lookback_days天内，与单日计算的取数范围一致
+                insert_sql = f"""
+                INSERT INTO trade_factor_stock_momentum 
+                (trade_date, code, name, volume_price_divergence_5d, created_time, updated_time)
+                SELECT 
+                    trade_date,
+                    code,
+                    name,
+                    ROUND((n * sxy - sx * sy) / SQRT((n * sxx - sx * sx) * (n * syy - sy * sy)), 4),
+                    NOW(),
+                    NOW()
+                FROM (
+                    SELECT 
+                        trade_date,
+                        code,
+                        name,
+                        MIN(trade_date) OVER w AS first_date,
+                        COUNT(tp) OVER w AS n,
+                        SUM(tp) OVER w AS sx,
+                        SUM(vol) OVER w AS sy,
+                        SUM(tp * vol) OVER w AS sxy,
+                        SUM(tp * tp) OVER w AS sxx,
+                        SUM(vol * vol) OVER w AS syy
+                    FROM (
+                        SELECT 
+                            trade_date,
+                            code,
+                            name,
+                            high + low + close AS tp,
+                            vol
+                        FROM trade_market_stock_daily 
+                        WHERE vol > 0 
+                            AND amount > 0
+                            AND close > 0
+                            {source_filter}
+                    ) base_data
+                    WINDOW w AS (
+                        PARTITION BY code ORDER BY trade_date 
+                        ROWS BETWEEN {int(self.window_size) - 1} PRECEDING AND CURRENT ROW
+                    )
+                ) window_stats
+                WHERE n >= %s
+                    AND first_date >= DATE_SUB(trade_date, INTERVAL %s DAY)
+                    AND n * sxx - sx * sx > 0
+                    AND n * syy - sy * sy > 0
+                    {range_filter}
+                """
+                cursor.execute(insert_sql, source_params + (self.window_size, self.lookback_days) + range_params)
+                inserted_count = cursor.rowcount
+            connection.commit()
             
-            self.logger.info(f"完成最近 {days} 天的动量因子计算，成功 {success_count}/{total_count} 天")
-            return success_count > 0
+            self.logger.info(f"动量因子数据批量更新完成: 清除 {deleted_count} 条，写入 {inserted_count} 条")
+            return inserted_count > 0
             
         except Exception as e:
-            self.logger.error(f"计算最近几天动量因子失败: {e}")
+            self.logger.error(f"批量更新动量因子数据失败: {e}")
+            if connection:
+                connection.rollback()
             return False
     
-    def update_factor_data(self, start_date: str = None, end_date: str = None) -> bool:
+    def update_factor_data(self, start_date: str = None, end_date: str = None, per_date: bool = False,
+                           workers: int = 1) -> bool:
         """
         更新动量因子数据
         
         Args:
             start_date: 开始日期 (YYYY-MM-DD)，可选，为None时更新全部数据
             end_date: 结束日期 (YYYY-MM-DD)，可选，为None时更新全部数据
+            per_date: 是否逐日计算，默认使用批量SQL一次完成
+            workers: 逐日计算时的并发线程数，默认1（串行）
             
         Returns:
             更新是否成功
         """
+        if not per_date:
+            return self.update_factor_data_bulk(start_date, end_date)
+        
+        connection = None
         try:
             if start_date and end_date:
                 self.logger.info(f"开始更新动量因子数据: {start_date} 到 {end_date}")
@@ -499,7 +492,9 @@ class MomentumFactorCalculator:
                 self.logger.warning("未获取到交易日期数据")
                 return False
             
-            # 先删除已有的因子数据
+            total_count = len(trade_dates)
+            
+            # 先删除已有的因子数据；之后逐日只写入，不再逐日DELETE
             if start_date and end_date:
                 if not self.clear_existing_data(start_date=start_date, end_date=end_date):
                     return False
@@ -507,31 +502,65 @@ class MomentumFactorCalculator:
                 if not self.clear_existing_data():
                     return False
             
-            # 批量计算和插入动量因子数据
-            all_momentum_data = []
-            success_count = 0
-            total_count = len(trade_dates)
-            
-            for i, trade_date in enumerate(trade_dates, 1):
-                self.logger.info(f"处理第 {i}/{total_count} 个交易日: {trade_date}")
+            if workers > 1 and total_count > 1:
+                # 计算在数据库内完成，各日期写入互不重叠；每个线程复用自己的连接，每个日期单独提交事务。
+                # 区间已整体清除，线程内不再逐日DELETE，避免并发事务在同一空隙上的间隙锁与插入意向锁互相死锁
+                worker_connections = []
+                connections_lock = threading.Lock()
                 
-                momentum_data = self.calculate_momentum_factors_for_date(trade_date)
-                if momentum_data:
-                    all_momentum_data.extend(momentum_data)
-                    success_count += 1
-                else:
-                    self.logger.warning(f"计算 {trade_date} 动量因子失败")
+                def _run(trade_date: str) -> bool:
+                    try:
+                        ok = self.calculate_momentum_factor(trade_date, clear_existing=False)
+                    finally:
+                        # 记录线程连接，全部日期完成后统一关闭
+                        worker_connection = getattr(self._local, 'connection', None)
+                        if worker_connection is not None:
+                            with connections_lock:
+                                if worker_connection not in worker_connections:
+                                    worker_connections.append(worker_connection)
+                    if not ok:
+                        self.logger.warning(f"计算 {trade_date} 动量因子失败")
+                    return ok
+                
+                try:
+                    with ThreadPoolExecutor(max_workers=min(workers, total_count)) as executor:
+                        success_count = sum(executor.map(_run, trade_dates))
+                finally:
+                    for worker_connection in worker_connections:
+                        try:
+                            worker_connection.close()
+                        except Exception:
+                            pass
+                
+                self.logger.info(f"动量因子数据更新完成: 成功 {success_count}/{total_count} 天")
+                return success_count > 0
             
-            # 批量插入所有数据
-            if all_momentum_data:
-                if not self.insert_momentum_factors(all_momentum_data):
-                    return False
+            # 每commit_batch_size个日期提交一次，避免单个事务长时间持有行情表上的共享锁
+            success_count = 0
+            inserted_total = 0
             
-            self.logger.info(f"动量因子数据更新完成: 成功 {success_count}/{total_count} 天，共插入 {len(all_momentum_data)} 条数据")
+            connection = self._get_db_connection()
+            with connection.cursor() as cursor:
+                for i, trade_date in enumerate(trade_dates, 1):
+                    self.logger.info(f"处理第 {i}/{total_count} 个交易日: {trade_date}")
+                    
+                    inserted_count = self._refresh_factor_for_date(cursor, trade_date, clear_existing=False)
+                    if inserted_count > 0:
+                        inserted_total += inserted_count
+                        success_count += 1
+                    else:
+                        self.logger.warning(f"计算 {trade_date} 动量因子失败")
+                    
+                    if i % self.commit_batch_size == 0 or i == total_count:
+                        connection.commit()
+            
+            self.logger.info(f"动量因子数据更新完成: 成功 {success_count}/{total_count} 天，共插入 {inserted_total} 条数据")
             return success_count > 0
             
         except Exception as e:
             self.logger.error(f"更新动量因子数据失败: {e}")
+            if connection:
+                connection.rollback()
             return False
     
     def _get_trade_dates_in_range(self, start_date: str, end_date: str) -> List[str]:
@@ -547,20 +576,17 @@ class MomentumFactorCalculator:
         """
         try:
             connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_daily 
-                    WHERE trade_date >= %s AND trade_date <= %s
-                    ORDER BY trade_date ASC
-                    """
-                    cursor.execute(sql, (start_date, end_date))
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-                    return trade_dates
-            finally:
-                connection.close()
+            with connection.cursor() as cursor:
+                sql = """
+                SELECT DISTINCT trade_date 
+                FROM trade_market_stock_daily 
+                WHERE trade_date >= %s AND trade_date <= %s
+                ORDER BY trade_date ASC
+                """
+                cursor.execute(sql, (start_date, end_date))
+                trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
+                             for row in cursor.fetchall()]
+                return trade_dates
         except Exception as e:
             self.logger.error(f"获取指定日期范围交易日期失败: {e}")
             return []
@@ -574,19 +600,16 @@ class MomentumFactorCalculator:
         """
         try:
             connection = self._get_db_connection()
-            try:
-                with connection.cursor() as cursor:
-                    sql = """
-                    SELECT DISTINCT trade_date 
-                    FROM trade_market_stock_daily 
-                    ORDER BY trade_date ASC
-                    """
-                    cursor.execute(sql)
-                    trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
-                                 for row in cursor.fetchall()]
-                    return trade_dates
-            finally:
-                connection.close()
+            with connection.cursor() as cursor:
+                sql = """
+                SELECT DISTINCT trade_date 
+                FROM trade_market_stock_daily 
+                ORDER BY trade_date ASC
+                """
+                cursor.execute(sql)
+                trade_dates = [row[0].strftime('%Y-%m-%d') if hasattr(row[0], 'strftime') else str(row[0]) 
+                             for row in cursor.fetchall()]
+                return trade_dates
         except Exception as e:
             self.logger.error(f"获取全部交易日期失败: {e}")
             return []
@@ -602,18 +625,24 @@ def main():
     parser.add_argument('--end-date', help='结束日期 (YYYY-MM-DD)，与--start-date配合使用')
     parser.add_argument('--days', type=int, help='计算最近N天')
     parser.add_argument('--all', action='store_true', help='更新全部数据')
+    parser.add_argument('--per-date', action='store_true', help='逐日计算（默认按区间批量计算）')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='逐日计算时的并发线程数 (默认1)')
+    parser.add_argument('--ensure-indexes', action='store_true', help='检查并创建所需索引（一次性迁移，不随日常任务执行）')
     
     args = parser.parse_args()
     
+    calculator = None
     try:
         calculator = MomentumFactorCalculator()
+        if args.ensure_indexes:
+            calculator.ensure_indexes()
         
         if args.all:
             # 更新全部数据
-            success = calculator.update_factor_data()
+            success = calculator.update_factor_data(per_date=args.per_date, workers=args.workers)
         elif args.start_date and args.end_date:
             # 更新指定日期范围的数据
-            success = calculator.update_factor_data(args.start_date, args.end_date)
+            success = calculator.update_factor_data(args.start_date, args.end_date, per_date=args.per_date, workers=args.workers)
         elif args.days:
             # 计算最近N天
             success = calculator.calculate_recent_days(args.days)
@@ -633,6 +662,9 @@ def main():
     except Exception as e:
         print(f"程序执行失败: {e}")
         sys.exit(1)
+    finally:
+        if calculator:
+            calculator.close()
 
 
 if __name__ == '__main__':
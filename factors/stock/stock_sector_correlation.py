@@ -40,6 +40,7 @@ class StockSectorCorrelationCalculator:
         self.db_config = config.database
         self.logger = self._setup_logger()
         self.window_size = 5  # 5日窗口
+        self.insert_batch_size = 5000  # 每条多行INSERT的最大行数
     
     def _setup_logger(self) -> logging.Logger:
         """设置日志"""
@@ -66,7 +67,7 @@ class StockSectorCorrelationCalculator:
                 password=self.db_config.password,
                 database=self.db_config.database,
                 charset=self.db_config.charset,
-                autocommit=True
+                autocommit=False
             )
             return connection
         except Exception as e:
@@ -116,10 +117,7 @@ class StockSectorCorrelationCalculator:
             
             # 构建股票到板块列表的映射
             stock_theme_map = {}
-            for _, row in df.iterrows():
-                stock_code = row['stock_code']
-                theme_code = row['theme_sector_code']
-                
+            for stock_code, theme_code in df[['stock_code', 'theme_sector_code']].to_numpy().tolist():
                 if stock_code not in stock_theme_map:
                     stock_theme_map[stock_code] = []
                 stock_theme_map[stock_code].append(theme_code)
@@ -157,13 +155,12 @@ class StockSectorCorrelationCalculator:
                 return pd.DataFrame()
             
             # 按股票代码分组，确保每只股票都有足够的历史数据
-            df_filtered = []
-            for code, group in df.groupby('code'):
-                if len(group) >= window_size:
-                    df_filtered.append(group.head(window_size))
+            # 一次groupby计算各代码行数并截取最近window_size天，避免逐组筛选拼接
+            group_sizes = df.groupby('code')['code'].transform('size')
+            result_df = df[group_sizes >= window_size].groupby('code').head(window_size)
             
-            if df_filtered:
-                result_df = pd.concat(df_filtered, ignore_index=True)
+            if not result_df.empty:
+                result_df = result_df.reset_index(drop=True)
                 self.logger.info(f"获取到 {len(result_df)} 条个股数据，涉及 {result_df['code'].nunique()} 只股票")
                 return result_df
             else:
@@ -200,13 +197,12 @@ class StockSectorCorrelationCalculator:
                 return pd.DataFrame()
             
             # 按板块代码分组，确保每个板块都有足够的历史数据
-            df_filtered = []
-            for code, group in df.groupby('code'):
-                if len(group) >= window_size:
-                    df_filtered.append(group.head(window_size))
+            # 一次groupby计算各代码行数并截取最近window_size天，避免逐组筛选拼接
+            group_sizes = df.groupby('code')['code'].transform('size')
+            result_df = df[group_sizes >= window_size].groupby('code').head(window_size)
             
-            if df_filtered:
-                result_df = pd.concat(df_filtered, ignore_index=True)
+            if not result_df.empty:
+                result_df = result_df.reset_index(drop=True)
                 self.logger.info(f"获取到 {len(result_df)} 条板块数据，涉及 {result_df['code'].nunique()} 个板块")
                 return result_df
             else:
@@ -278,6 +274,40 @@ class StockSectorCorrelationCalculator:
             self.logger.error(f"提取K线特征失败: {e}")
             return KLineFeatures(0, 0.0, 0.0, 0.0)
     
+    def extract_kline_features_batch(self, df: pd.DataFrame) -> List[KLineFeatures]:
+        """
+        批量提取K线特征，规则与extract_kline_features一致
+        
+        Args:
+            df: 包含open、high、low、close列的DataFrame
+            
+        Returns:
+            List[KLineFeatures]: 与df逐行对应的K线特征列表
+        """
+        open_arr, high_arr, low_arr, close_arr = (
+            pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+            for col in ('open', 'high', 'low', 'close')
+        )
+        
+        # 缺失值、最高价不高于最低价或价格非正的K线均视为无效
+        valid = (
+            ~np.isnan(open_arr) & ~np.isnan(close_arr)
+            & (high_arr > low_arr) & (high_arr > 0) & (low_arr > 0)
+        )
+        price_range = np.where(valid, high_arr - low_arr, 1.0)
+        
+        with np.errstate(invalid='ignore'):
+            direction = np.where(valid, np.sign(close_arr - open_arr), 0).astype(int)
+            body_ratio = np.where(valid, np.abs(close_arr - open_arr) / price_range, 0.0)
+            upper_shadow_ratio = np.where(valid, (high_arr - np.maximum(open_arr, close_arr)) / price_range, 0.0)
+            lower_shadow_ratio = np.where(valid, (np.minimum(open_arr, close_arr) - low_arr) / price_range, 0.0)
+        
+        return [
+            KLineFeatures(d, b, u, l)
+            for d, b, u, l in zip(direction.tolist(), body_ratio.tolist(),
+                                  upper_shadow_ratio.tolist(), lower_shadow_ratio.tolist())
+        ]
+    
     def calculate_cosine_similarity(self, features1: List[KLineFeatures], 
                                    features2: List[KLineFeatures]) -> float:
         """
@@ -353,22 +383,22 @@ class StockSectorCorrelationCalculator:
             
             correlation_data = []
             
+            # 整表按代码、日期排序一次，分组后各组已按日期升序，无需逐组排序
+            stock_df = stock_df.sort_values(['code', 'trade_date'], kind='mergesort')
+            sector_df = sector_df.sort_values(['code', 'trade_date'], kind='mergesort')
+            
+            # 整表向量化提取K线特征，避免逐行调用
+            stock_df['kline_feature'] = self.extract_kline_features_batch(stock_df)
+            sector_df['kline_feature'] = self.extract_kline_features_batch(sector_df)
+            
             # 按股票分组计算特征
             stock_features = {}
-            for stock_code, stock_group in stock_df.groupby('code'):
+            for stock_code, stock_group in stock_df.groupby('code', sort=False):
                 if len(stock_group) < self.window_size:
                     continue
                 
-                # 按日期排序
-                stock_group = stock_group.sort_values('trade_date')
-                
                 # 提取K线特征
-                features = []
-                for _, row in stock_group.iterrows():
-                    feature = self.extract_kline_features(
-                        row['open'], row['high'], row['low'], row['close']
-                    )
-                    features.append(feature)
+                features = stock_group['kline_feature'].tolist()
                 
                 stock_features[stock_code] = {
                     'name': stock_group.iloc[-1]['name'],
@@ -378,20 +408,12 @@ class StockSectorCorrelationCalculator:
             
             # 按板块分组计算特征
             sector_features = {}
-            for sector_code, sector_group in sector_df.groupby('code'):
+            for sector_code, sector_group in sector_df.groupby('code', sort=False):
                 if len(sector_group) < self.window_size:
                     continue
                 
-                # 按日期排序
-                sector_group = sector_group.sort_values('trade_date')
-                
                 # 提取K线特征
-                features = []
-                for _, row in sector_group.iterrows():
-                    feature = self.extract_kline_features(
-                        row['open'], row['high'], row['low'], row['close']
-                    )
-                    features.append(feature)
+                features = sector_group['kline_feature'].tolist()
                 
                 sector_features[sector_code] = {
                     'name': sector_group.iloc[-1]['name'],
@@ -533,10 +555,13 @@ class StockSectorCorrelationCalculator:
                 else:
                     self.logger.info("没有需要清除的历史数据")
                 
+                connection.commit()
                 return True
                 
         except Exception as e:
             self.logger.error(f"清除历史数据失败: {e}")
+            if 'connection' in locals():
+                connection.rollback()
             return False
         finally:
             if 'connection' in locals():
@@ -551,11 +576,13 @@ class StockSectorCorrelationCalculator:
         try:
             connection = self._get_db_connection()
             with connection.cursor() as cursor:
-                sql = """
-                INSERT INTO trade_factor_stock_sector_correlation 
-                (trade_date, stock_code, stock_name, sector_code, sector_name, 
+                insert_sql = """
+                INSERT INTO trade_factor_stock_sector_correlation
+                (trade_date, stock_code, stock_name, sector_code, sector_name,
                  cosine_similarity_today, cosine_similarity_3d, cosine_similarity_5d)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES
+                """
+                update_sql = """
                 ON DUPLICATE KEY UPDATE
                 stock_name = VALUES(stock_name),
                 sector_name = VALUES(sector_name),
@@ -564,11 +591,11 @@ class StockSectorCorrelationCalculator:
                 cosine_similarity_5d = VALUES(cosine_similarity_5d),
                 updated_time = CURRENT_TIMESTAMP
                 """
-                
+                row_template = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+
                 # 准备数据
-                data_list = []
-                for item in correlation_data:
-                    data_list.append([
+                data_list = [
+                    (
                         item['trade_date'],
                         item['stock_code'],
                         item['stock_name'],
@@ -577,16 +604,25 @@ class StockSectorCorrelationCalculator:
                         item['cosine_similarity_today'],
                         item['cosine_similarity_3d'],
                         item['cosine_similarity_5d']
-                    ])
-                
-                # 批量插入
-                cursor.executemany(sql, data_list)
-                
+                    )
+                    for item in correlation_data
+                ]
+
+                # 分批拼接多行VALUES，每批一条INSERT语句
+                for start in range(0, len(data_list), self.insert_batch_size):
+                    chunk = data_list[start:start + self.insert_batch_size]
+                    values_sql = ",".join(cursor.mogrify(row_template, row) for row in chunk)
+                    cursor.execute(insert_sql + values_sql + update_sql)
+
+                # 所有批次在同一事务内提交，只触发一次刷盘
+                connection.commit()
                 self.logger.info(f"成功插入 {len(data_list)} 条相关性数据")
                 return True
                 
         except Exception as e:
             self.logger.error(f"插入相关性数据失败: {e}")
+            if 'connection' in locals():
+                connection.rollback()
             return False
         finally:
             if 'connection' in locals():